@@ -1,10 +1,11 @@
+import shutil
 import tomllib
 from pathlib import Path
 
 import typer
 from platformdirs import user_config_path
 
-from .deploy import compress_dir, deploy_blog, refresh_site_search_db
+from .deploy import compress_dir, deploy_blog, refresh_site_search_db, sync_blog
 from .gen import generate_blog, init_new_blog, init_new_post
 from .log_config import log_init, app_logger
 
@@ -120,7 +121,11 @@ def run(
     root_node = generate_blog(str(origin), str(target))
 
     if deploy and server and server_target:
-        tar_path = compress_dir(root_node.destination_path)
-        deploy_blog(server, tar_path, server_target)
+        if shutil.which('rsync'):
+            sync_blog(server, root_node.destination_path, server_target)
+        else:
+            # 本地没有 rsync 时，打包上传整个目录
+            tar_path = compress_dir(root_node.destination_path)
+            deploy_blog(server, tar_path, server_target)
 
         refresh_site_search_db()
\ No newline at end of file
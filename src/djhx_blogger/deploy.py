@@ -1,14 +1,18 @@
+import os
+import shutil
+import subprocess
 import tarfile
 from getpass import getpass
 from pathlib import Path
 from urllib import request
 
-from fabric import Connection, Config
-
 from .log_config import app_logger
 
 logger = app_logger
 
+# 部署使用的远程服务器用户
+DEPLOY_USER = 'koril'
+
 
 def compress_dir(blog_path: Path) -> Path:
     """
@@ -17,28 +21,83 @@ def compress_dir(blog_path: Path) -> Path:
     logger.info(f'压缩目录: {blog_path}')
     output_tar = blog_path.parent / 'public.tar.gz'
 
-    with tarfile.open(output_tar, "w:gz") as tar:
-        tar.add(str(blog_path), arcname="public")
+    pigz = shutil.which('pigz')
+    if pigz:
+        # tar 流通过管道交给 pigz 多线程压缩
+        with open(output_tar, 'wb') as output_file:
+            proc = subprocess.Popen([pigz, '-p', str(os.cpu_count() or 1)], stdin=subprocess.PIPE, stdout=output_file)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                    tar.add(str(blog_path), arcname="public")
+            except BrokenPipeError:
+                # pigz 提前退出，退出码在下面统一报告
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+                return_code = proc.wait()
+        if return_code != 0:
+            raise RuntimeError(f'pigz 压缩失败，退出码: {return_code}')
+    else:
+        # 没有 pigz 时使用标准库单线程压缩，压缩级别取 1 换取速度
+        with tarfile.open(output_tar, "w:gz", compresslevel=1) as tar:
+            tar.add(str(blog_path), arcname="public")
 
     logger.info(f'压缩完成: {output_tar}')
     return output_tar
 
 
+def connect_server(server_name: str):
+    """
+    输入 sudo 密码并建立到远程服务器的连接（ssh 登录和 sudo 使用同一个密码）
+    """
+    # fabric（paramiko）导入较慢，只在部署时导入
+    from fabric import Connection, Config
+
+    sudo_pass = getpass("[sudo]: ")
+    config = Config(overrides={'sudo': {'password': sudo_pass}})
+    return Connection(host=server_name, user=DEPLOY_USER, config=config, connect_kwargs={'password': sudo_pass})
+
+
+def normalize_web_root(remote_web_root: str) -> str:
+    if not remote_web_root.endswith('/'):
+        remote_web_root += '/'
+    return remote_web_root
+
+
+def backup_remote_blog(c, remote_web_root: str):
+    """
+    删除旧的 blog.bak，并将当前的 blog 备份为 blog.bak
+    第一次部署时远程 blog 目录不存在，跳过备份
+    """
+    remote_target_path = f'{remote_web_root}blog'
+
+    # 删除旧备份
+    c.sudo(f'rm -rf {remote_target_path}.bak')
+    logger.info('旧 blog.bak 删除')
+
+    # 备份 blog
+    if c.sudo(f'test -e {remote_target_path}', warn=True, hide=True).ok:
+        c.sudo(f'mv {remote_target_path} {remote_target_path}.bak')
+        logger.info('blog -> blog.bak')
+    else:
+        logger.info(f'{remote_target_path} 不存在，跳过备份')
+
+
 def deploy_blog(server_name: str, local_tar_path: Path, remote_web_root: str):
     """
     将 tar.gz 文件部署到远程服务器
     """
     logger.info(f'开始部署 -> 服务器: {server_name}，文件: {local_tar_path}')
 
-    sudo_pass = getpass("[sudo]: ")
-    config = Config(overrides={'sudo': {'password': sudo_pass}})
-    c = Connection(host=server_name, user='koril', config=config, connect_kwargs={'password': sudo_pass})
+    c = connect_server(server_name)
 
     remote_home_path = f'/home/{c.user}'
     remote_tar_path = f'{remote_home_path}/{local_tar_path.name}'
 
-    if not remote_web_root.endswith('/'):
-        remote_web_root += '/'
+    remote_web_root = normalize_web_root(remote_web_root)
     remote_target_path = f'{remote_web_root}blog'
 
     try:
@@ -46,13 +105,7 @@ def deploy_blog(server_name: str, local_tar_path: Path, remote_web_root: str):
         c.put(str(local_tar_path), remote=remote_home_path)
         logger.info('上传完成')
 
-        # 删除旧备份
-        c.sudo(f'rm -rf {remote_web_root}blog.bak')
-        logger.info('旧 blog.bak 删除')
-
-        # 备份 blog
-        c.sudo(f'mv {remote_target_path} {remote_target_path}.bak')
-        logger.info('blog -> blog.bak')
+        backup_remote_blog(c, remote_web_root)
 
         # 移动 tar.gz 并解压
         c.sudo(f'mv {remote_tar_path} {remote_web_root}')
@@ -64,10 +117,47 @@ def deploy_blog(server_name: str, local_tar_path: Path, remote_web_root: str):
         c.sudo(f'mv {remote_web_root}public {remote_target_path}')
         logger.info('部署完成')
 
-    except Exception as e:
-        logger.exception(f"部署失败")
+    except Exception:
+        logger.exception('部署失败')
+        raise
+
+
+def sync_blog(server_name: str, local_blog_path: Path, remote_web_root: str):
+    """
+    使用 rsync 将生成的博客目录增量同步到远程服务器
+    先同步到用户目录下的 blog-staging（保留到下一次部署，只传输变化的文件），
+    再用 sudo 将其复制为 web 根目录下的 blog
+    第一次同步时 staging 为空，rsync 会传输全部文件
+    rsync 通过 ssh 传输，建议配置 ssh key 登录
+    """
+    logger.info(f'开始同步 -> 服务器: {server_name}，目录: {local_blog_path}')
+
+    c = connect_server(server_name)
+
+    remote_staging_path = f'/home/{c.user}/blog-staging'
+
+    remote_web_root = normalize_web_root(remote_web_root)
+    remote_target_path = f'{remote_web_root}blog'
+
+    try:
+        # 增量同步
+        subprocess.run(
+            ['rsync', '-az', '--delete', '--partial', f'{local_blog_path}/', f'{c.user}@{server_name}:{remote_staging_path}/'],
+            check=True,
+        )
+        logger.info('同步完成')
+
+        backup_remote_blog(c, remote_web_root)
+
+        # staging 保留给下一次同步，复制一份作为新的 blog
+        c.sudo(f'cp -a {remote_staging_path} {remote_target_path}')
+        logger.info('部署完成')
+
+    except Exception:
+        logger.exception('部署失败')
         raise
 
+
 def refresh_site_search_db():
     """
     来自另一个项目——djhx-site-search 的接口
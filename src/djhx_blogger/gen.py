@@ -1,23 +1,69 @@
+import functools
+import hashlib
+import json
 import os
 import shutil
+import tempfile
 import time
 from collections import deque, OrderedDict, defaultdict
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from html import escape
 from importlib import resources
+from importlib.metadata import PackageNotFoundError, version
 from pathlib import Path
+from typing import Any, Callable, Optional, Union
 
 import markdown
 from PIL import Image
-from bs4 import BeautifulSoup
-from jinja2 import Template
+from jinja2 import Environment, PackageLoader
+from platformdirs import user_cache_path
 
 from .log_config import app_logger
 
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    # Windows 没有 fcntl
+    HAS_FCNTL = False
+
 logger = app_logger
 
 ignore_item = ['.git', 'LICENSE']
 
+# 增量构建记录文件，保存在输出目录（public 的上级目录）下
+MANIFEST_NAME = '.build_manifest.json'
+# manifest 结构变化时修改，旧 manifest 会被忽略
+MANIFEST_FORMAT = 3
+
+# markdown 扩展及其配置
+MD_EXTENSIONS = [
+    'markdown.extensions.toc',
+    'markdown.extensions.tables',
+    'markdown.extensions.sane_lists',
+    'markdown.extensions.fenced_code'
+]
+MD_EXTENSION_CONFIGS: dict[str, dict[str, Any]] = {}
+
+# markdown 渲染结果缓存目录，markdown 版本或扩展配置变化时缓存自动失效
+MD_CACHE_DIR = user_cache_path(appname='djhx-blogger', appauthor='djhx') / 'md'
+MD_CACHE_KEY = json.dumps(
+    [markdown.__version__, MD_EXTENSIONS, MD_EXTENSION_CONFIGS], sort_keys=True
+).encode('utf-8')
+MD_CACHE_MAX_AGE_DAYS = 30
+
+# manifest 记录：key 为相对源路径，value 为指纹（或子节点）和相对目标路径
+ManifestEntries = dict[str, dict[str, Any]]
+# 分类页中子节点的排序键，见 node_sort_key
+SortKey = tuple[int, Union[str, float]]
+
+# 用 PIL 压缩的图片类型，其他文件直接复制
+COMPRESSIBLE_IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+# linux/fs.h: FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
 process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() + 1)
 
 
@@ -31,251 +77,464 @@ def load_image(img_name: str) -> Path:
     return Path(str(file_path))
 
 
+def split_article_template(template: str) -> tuple[str, str, str]:
+    """
+    在模块加载时计算 <title> 和 <article> 标签内容的位置，将文章模板切分为三段：
+    head（到 <title> 为止）、mid（</title> 到 <article ...> 为止）、tail（从 </article> 开始），
+    生成文章页面时只做字符串拼接。两个标签内原有的内容会被替换
+    """
+    try:
+        title_start = template.index('<title>') + len('<title>')
+        title_end = template.index('</title>', title_start)
+        article_start = template.index('>', template.index('<article', title_end)) + 1
+        article_end = template.index('</article>', article_start)
+    except ValueError:
+        raise ValueError('文章模板需要包含 <title></title> 和 <article></article>') from None
+    return template[:title_start], template[title_end:article_start], template[article_end:]
+
+
+# 文章模板只在模块加载时读取一次
+ARTICLE_TEMPLATE_PARTS = split_article_template(load_template('article.html'))
+
+# jinja2 模板和 markdown 处理器在模块加载时创建，渲染时复用
+template_env = Environment(loader=PackageLoader('djhx_blogger', 'static/template'), auto_reload=False)
+category_template = template_env.get_template('category.html')
+
+md_processor = markdown.Markdown(extensions=MD_EXTENSIONS, extension_configs=MD_EXTENSION_CONFIGS)
+
+
 class Node:
-    cache_map = {}
 
-    def __init__(self, source_path, destination_path, node_type):
+    def __init__(self, source_path: Path, destination_path: Path, node_type: str):
         # 该节点的源目录路径
         self.source_path = source_path
         # 该节点生成的结果目录路径
         self.destination_path = destination_path
         # 子节点
-        self.children = []
+        self.children: list['Node'] = []
         # 节点类型：
         # 1. category 包含多个子目录
         # 2. article 包含一个 index.md 文件和 images 目录
         # 3. leaf index.md 或者 images 目录
         self.node_type = node_type
         # 描述分类或者文章的元信息（比如：文章的标题，简介和日期）
-        self.metadata = None
-
-        Node.cache_map[source_path] = self
+        self.metadata: Optional[dict[str, str]] = None
+        # 文章正文（去掉元信息的 markdown 内容），只有 article 节点有值
+        self.md_body: Optional[str] = None
+        # 在分类页中的排序键，见 node_sort_key
+        self.sort_key: Optional[SortKey] = None
 
     def __str__(self):
         return f'path={self.source_path}'
 
 
-def walk_dir(dir_path_str: str, destination_blog_dir_path_str: str, target_name: str='public') -> Node:
+def walk_dir(dir_path_str: str, destination_blog_dir_path_str: str, target_name: str='public') -> tuple[Node, list[Node]]:
     """
     遍历目录，构造树结构
     :param dir_path_str: 存放博客 md 文件的目录的字符串
     :param destination_blog_dir_path_str: 生成博客目录的地址
     :param target_name: 生成博客的目录名称
-    :return: 树结构的根节点
+    :return: (树结构的根节点, 按层次遍历顺序排列的全部节点)，
+             后续生成步骤直接按顺序遍历节点列表，不需要再次做层次遍历
     """
 
     start = int(time.time() * 1000)
-    q = deque()
+    q: deque[tuple[Path, bool, Optional[Node]]] = deque()
     dir_path = Path(dir_path_str)
-    q.append(dir_path)
+    # 队列元素为 (路径, 是否为目录, 父节点)，子节点的目录判定来自父目录 scandir 的 DirEntry
+    q.append((dir_path, dir_path.is_dir(), None))
 
     # 生成目录的根路径
     destination_root_dir = Path(destination_blog_dir_path_str).joinpath(target_name)
     logger.info(f'源路经: {dir_path}, 目标路径: {destination_root_dir}')
 
-    root = None
+    root: Optional[Node] = None
+    tree_nodes: list[Node] = []
 
     # 层次遍历
     while q:
-        item = q.popleft()
+        item, is_dir, parent = q.popleft()
         if item.name in ignore_item:
             logger.info(f'略过: {item.name}')
             continue
-        if Path.is_dir(item):
-            [q.append(e) for e in item.iterdir()]
 
         # node 类型判定
         node_type = 'leaf'
-        if Path.is_dir(item):
+        entries = []
+        if is_dir:
             node_type = 'category'
+            # 每个目录只 scandir 一次，DirEntry.is_dir() 使用 getdents 返回的类型信息，不需要额外 stat
+            with os.scandir(item) as it:
+                entries = list(it)
             # 如果目录包含 index.md 则是文章目录节点
-            for e in item.iterdir():
-                if e.name == 'index.md':
-                    node_type = 'article'
-                    break
+            if any(e.name == 'index.md' for e in entries):
+                node_type = 'article'
 
-        if not root:
-            root = Node(item, destination_root_dir, node_type)
+        if parent is None:
+            node = root = Node(item, destination_root_dir, node_type)
         else:
-            cur_node = Node.cache_map[item.parent]
-            # 计算相对路径
-            relative_path = item.relative_to(dir_path)
-            # 构造目标路径
-            destination_path = destination_root_dir / relative_path
+            # 目标路径 = 父节点目标路径 / 当前名称
+            destination_path = parent.destination_path / item.name
             if destination_path.name == 'index.md':
                 destination_path = destination_path.parent / Path('index.html')
-            n = Node(item, destination_path, node_type)
-            cur_node.children.append(n)
+            node = Node(item, destination_path, node_type)
+            parent.children.append(node)
+
+        tree_nodes.append(node)
+        q.extend((Path(e.path), e.is_dir(), node) for e in entries)
+
+        if node_type == 'article':
+            # index.md 只读取一次，元信息和正文都保存在节点上
+            content = (item / 'index.md').read_text(encoding='utf-8')
+            raw_metadata, node.md_body = split_front_matter(content)
+            node.metadata = parse_metadata(raw_metadata)
+
+        # 排序键在构造树时计算一次，生成分类页时不再重复解析日期
+        node.sort_key = node_sort_key(node)
     end = int(time.time() * 1000)
     logger.info(f'构造树耗时: {end - start} ms')
 
-    return root
+    if root is None:
+        raise ValueError(f'博客目录不可用: {dir_path}')
+    return root, tree_nodes
 
 
-def md_to_html(md_file_path: Path) -> str:
+@functools.lru_cache(maxsize=None)
+def md_to_html(md_content: str) -> str:
     """
     markdown -> html
-    :param md_file_path: markdown 文件的路径对象
+    渲染结果按内容哈希缓存到磁盘（MD_CACHE_DIR/<hash>.html），内容未变化的文章直接读取缓存
+    :param md_content: 去掉元信息的 markdown 正文
     :return: html str
     """
+    md_hash = hashlib.blake2b(MD_CACHE_KEY, digest_size=16)
+    md_hash.update(b'\0')
+    md_hash.update(md_content.encode('utf-8'))
+    digest = md_hash.hexdigest()
+    cache_file = MD_CACHE_DIR / f'{digest}.html'
+
+    if cache_file.is_file():
+        try:
+            html = cache_file.read_text(encoding='utf-8')
+            # 刷新 mtime，过期清理按最近一次使用时间计算
+            os.utime(cache_file)
+            return html
+        except OSError as e:
+            logger.warning(f'读取 markdown 缓存失败: {cache_file}, {e}')
+
+    # reset() 清理上一篇文章遗留的状态（比如 toc）
+    html = md_processor.reset().convert(md_content)
+
+    # 先写临时文件再替换，避免多个进程同时写入时读到不完整的缓存
+    try:
+        MD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MD_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, mode='w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        logger.warning(f'写入 markdown 缓存失败: {cache_file}, {e}')
 
-    def remove_metadata(content: str) -> str:
-        """
-        删除文章开头的 YAML 元信息
-        :param content: markdown 内容
-        """
-        lines = content.splitlines()
-        if lines and lines[0] == '---':
-            for i in range(1, len(lines)):
-                if lines[i] == '---':
-                    return '\n'.join(lines[i + 1:])
-        return md_content
-
-    with open(md_file_path, mode='r', encoding='utf-8') as md_file:
-        md_content = md_file.read()
-        md_content = remove_metadata(md_content)
-        return markdown.markdown(
-            md_content,
-            extensions=[
-                'markdown.extensions.toc',
-                'markdown.extensions.tables',
-                'markdown.extensions.sane_lists',
-                'markdown.extensions.fenced_code'
-            ]
-        )
-
-
-def gen_article_index(md_file_path: Path, article_name):
-
-    bs1 = BeautifulSoup(load_template('article.html'), "html.parser")
-    bs2 = BeautifulSoup(md_to_html(md_file_path), "html.parser")
+    return html
 
-    article_metadata = read_metadata(md_file_path)
 
-    article_tag = bs1.find('article')
-    # 添加 h1 标题
-    h1_tag = bs1.new_tag('h1')
-    h1_tag.string = article_name
-    article_tag.insert(0, h1_tag)
+def prune_md_cache(max_age_days: int = MD_CACHE_MAX_AGE_DAYS):
+    """
+    删除超过 max_age_days 天未使用的 markdown 缓存
+    """
+    if not MD_CACHE_DIR.is_dir():
+        return
+    expire_time = time.time() - max_age_days * 24 * 60 * 60
+    removed = 0
+    for cache_file in MD_CACHE_DIR.iterdir():
+        try:
+            if cache_file.stat().st_mtime < expire_time:
+                cache_file.unlink()
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f'清理过期 markdown 缓存: {removed} 个')
 
-    # 添加日期信息
-    time_tag = bs1.new_tag('time', datetime=article_metadata["date"])
-    time_tag.string = '时间: ' + article_metadata["date"]
 
-    # 添加摘要信息
-    summary_tag = bs1.new_tag('p')
-    summary_tag.string = '摘要: ' + article_metadata["summary"]
+def gen_article_index(article_name: str, article_metadata: dict[str, str], md_body: str) -> str:
+    """
+    将文章渲染后的 html 拼接进文章模板
+    在进程池中执行，参数只包含渲染需要的数据，避免序列化整个节点子树
+    :param article_name: 文章名称（文章目录名）
+    :param article_metadata: 文章元信息
+    :param md_body: 去掉元信息的 markdown 正文
+    :return: html str
+    """
+    head, mid, tail = ARTICLE_TEMPLATE_PARTS
 
-    # 包裹元信息
-    meta_wrapper = bs1.new_tag('div', **{"class": "article-meta"})
-    meta_wrapper.append(time_tag)
-    meta_wrapper.append(bs1.new_tag('br'))
-    meta_wrapper.append(summary_tag)
+    name = escape(article_name, quote=False)
+    date = escape(article_metadata["date"], quote=False)
+    summary = escape(article_metadata["summary"], quote=False)
 
-    # 插入到 h1 之后
-    h1_tag.insert_after(meta_wrapper)
+    # h1 标题 -> 元信息（日期、摘要） -> 分割线 -> 正文
+    article_html = (
+        f'<h1>{name}</h1>'
+        f'<div class="article-meta">'
+        f'<time datetime="{escape(article_metadata["date"])}">时间: {date}</time><br/><p>摘要: {summary}</p>'
+        f'</div>'
+        f'<hr/>'
+        f'{md_to_html(md_body)}'
+    )
 
-    # 添加标题和正文之间的换行符
-    article_tag.append(bs1.new_tag('hr'))
-    # 添加正文内容
-    article_tag.append(bs2)
-    # 修改页面标题
-    bs1.find('title').string = f'文章 | {article_name}'
+    return f'{head}文章 | {name}{mid}{article_html}{tail}'
 
-    return bs1.prettify()
 
+def gen_category_index(categories: list[dict[str, Any]], category_name: str) -> str:
+    return category_template.render(categories=categories, category_name=category_name)
 
-def gen_category_index(categories: list, category_name) -> str:
-    template = Template(load_template('category.html'))
-    html = template.render(categories=categories, category_name=category_name)
-    return html
 
-
-def sort_categories(item):
+def node_sort_key(node: Node) -> SortKey:
     """
-    对 categories 排序，type = category 排在所有 type = article 前
+    分类页中子节点的排序键，type = category 排在所有 type = article 前
     category 按照 name 字典顺序 a-z 排序
     article 按照 metadata 的 date 字段（格式：2024-02-03T14:44:42+08:00）降序排列。
-    :param item:
+    :param node: 节点，article 节点需要先读取 metadata
     :return:
     """
-    from datetime import datetime
-    if item['type'] == 'category':
+    if node.node_type == 'category':
         # 分类优先，按 name 排序
-        return 0, item['name'].lower()
-    elif item['type'] == 'article':
+        return 0, node.source_path.name.lower()
+    elif node.node_type == 'article':
         # 文章按日期降序排序，优先级次于 category
         # 将日期解析为 datetime 对象，若无日期则排在最后
-        date = item['metadata'].get('date')
+        date = (node.metadata or {}).get('date')
         parsed_date = datetime.fromisoformat(date) if date else datetime(year=1970, month=1, day=1)
         return 1, -parsed_date.timestamp()
+    # 其他文件排在最后
+    return 2, node.source_path.name.lower()
+
+
+def file_fingerprint(file_path: Path) -> list[int]:
+    """
+    文件指纹：(mtime_ns, size)，用于增量构建时判断源文件是否变化
+    """
+    st = file_path.stat()
+    return [st.st_mtime_ns, st.st_size]
+
+
+def build_signature() -> str:
+    """
+    构建签名：包版本 + 模板内容哈希 + markdown 版本和扩展配置
+    生成结果除了源文件还依赖模板和渲染代码，签名变化时需要全量构建
+    """
+    try:
+        package_version = version('djhx-blogger')
+    except PackageNotFoundError:
+        package_version = 'unknown'
+    template_hash = hashlib.blake2b(digest_size=16)
+    for template_name in sorted(template_env.list_templates()):
+        template_hash.update(template_name.encode('utf-8'))
+        template_hash.update(load_template(template_name).encode('utf-8'))
+    md_hash = hashlib.blake2b(MD_CACHE_KEY, digest_size=16)
+    return f'{MANIFEST_FORMAT}:{package_version}:{template_hash.hexdigest()}:{md_hash.hexdigest()}'
+
+
+def load_manifest(manifest_path: Path, signature: str) -> ManifestEntries:
+    """
+    读取上一次构建的 manifest 记录
+    文件不存在、解析失败或构建签名不一致时返回空字典
+    """
+    if not manifest_path.is_file():
+        return {}
+    try:
+        with open(manifest_path, mode='r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f'读取构建 manifest 失败，进行全量构建: {e}')
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('signature') != signature:
+        logger.info('模板或程序版本发生变化，进行全量构建')
+        return {}
+    return manifest.get('entries', {})
+
+
+def save_manifest(manifest_path: Path, signature: str, entries: ManifestEntries):
+    with open(manifest_path, mode='w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'entries': entries}, f, ensure_ascii=False)
+
+
+def update_manifest(old_manifest: ManifestEntries, new_manifest: ManifestEntries, root: Node,
+                    source_path: Path, destination_path: Path) -> bool:
+    """
+    将源文件指纹记录到 new_manifest
+    key 和 destination 分别是相对根节点源路径、目标路径的路径，与命令行中路径的写法无关
+    :return: 源文件与上一次构建相比未变化，且目标文件存在时返回 True
+    """
+    key = source_path.relative_to(root.source_path).as_posix()
+    fingerprint = file_fingerprint(source_path)
+    new_manifest[key] = {
+        'fingerprint': fingerprint,
+        'destination': destination_path.relative_to(root.destination_path).as_posix(),
+    }
+    old_entry = old_manifest.get(key)
+    return old_entry is not None and old_entry.get('fingerprint') == fingerprint and destination_path.exists()
+
+
+def remove_stale_outputs(root: Node, old_manifest: ManifestEntries, new_manifest: ManifestEntries):
+    """
+    删除源文件已经不存在的生成结果，以及因此变空的目录（不超过目标根目录）
+    """
+    current_destinations = {entry['destination'] for entry in new_manifest.values()}
+    # 当前构建的目标文件所在的目录，即使暂时为空也不能删除
+    current_dirs = {(root.destination_path / d).parent for d in current_destinations}
+    for key in old_manifest.keys() - new_manifest.keys():
+        destination = old_manifest[key]['destination']
+        # 同一个目标文件仍然由其他源文件生成，不能删除
+        if destination in current_destinations:
+            continue
+        stale_path = root.destination_path / destination
+        if not stale_path.is_file():
+            continue
+        logger.info(f'删除过期文件: {stale_path}')
+        stale_path.unlink()
+
+        # 自底向上删除空目录，最后一个文件被删除时清理到最上层的空目录
+        parent = stale_path.parent
+        while (parent != root.destination_path and parent not in current_dirs
+               and parent.is_dir() and not any(parent.iterdir())):
+            parent.rmdir()
+            parent = parent.parent
 
 
-def gen_blog_dir(root: Node):
+def gen_blog_dir(root: Node, tree_nodes: list[Node], resource_task: Optional[Callable[[], None]] = None):
     """
     根据目录树构造博客目录
+    增量构建：读取上一次构建的 manifest，源文件指纹未变化且目标文件存在时跳过生成，
+    分类页只在子节点成员变化或子文章变化时重新生成
     :param root: 树结构根节点
+    :param tree_nodes: walk_dir 返回的层次遍历节点列表
+    :param resource_task: 复制静态资源的函数，进程池任务全部提交后在后台线程中执行，与文章渲染并行
     :return:
     """
 
     start = int(time.time() * 1000)
 
-    q = deque()
-    q.append(root)
+    manifest_path = root.destination_path.parent / MANIFEST_NAME
+    signature = build_signature()
+    old_manifest = load_manifest(manifest_path, signature)
+    new_manifest: ManifestEntries = {}
 
-    # 清理之前生成的 root destination
-    if Path.exists(root.destination_path):
+    # 没有可用 manifest 的旧目标目录无法判断哪些文件过期，清理后全量构建
+    if not old_manifest and Path.exists(root.destination_path):
         logger.info(f'存在目标目录: {root.destination_path}，进行删除')
         shutil.rmtree(root.destination_path)
 
-    while q:
-        node = q.popleft()
-        [q.append(child) for child in node.children]
+    Path.mkdir(root.destination_path, parents=True, exist_ok=True)
+
+    # 需要重新生成 index.html 的分类（manifest key）
+    dirty_categories = set()
+    category_nodes = []
+    article_jobs = []
+    compress_futures = []
+    skipped = 0
 
+    for node in tree_nodes:
         # 对三种不同类型的节点分别进行处理
 
         if node.node_type == 'category' and node.source_path.name != 'images':
             Path.mkdir(node.destination_path, parents=True, exist_ok=True)
-            category_index = node.destination_path / Path('index.html')
-            categories = []
-            for child in node.children:
-                if child:
-                    if child.node_type == 'article':
-                        child.metadata = read_metadata(child.source_path / Path('index.md'))
-                    relative_path = child.destination_path.name / Path('index.html')
-                    categories.append({
-                        'type': child.node_type,
-                        'name': child.destination_path.name,
-                        'href': relative_path,
-                        'metadata': child.metadata,
-                    })
-            categories.sort(key=sort_categories)
-            with open(category_index, mode='w', encoding='utf-8') as f:
-                f.write(gen_category_index(categories, node.source_path.name))
+            # 分类页依赖子文章的元信息，等所有文章处理完后再生成
+            category_nodes.append(node)
 
         if node.node_type == 'category' and node.source_path.name == 'images':
             Path.mkdir(node.destination_path, parents=True, exist_ok=True)
 
         if node.node_type == 'article':
             Path.mkdir(node.destination_path, parents=True, exist_ok=True)
+            md_file_path = node.source_path / Path('index.md')
+            if update_manifest(old_manifest, new_manifest, root, md_file_path, node.destination_path / Path('index.html')):
+                skipped += 1
+            else:
+                # 目录已经同步创建，渲染交给进程池
+                article_jobs.append(node)
+                # 文章变化后，所在分类的列表（日期、摘要）也需要更新
+                dirty_categories.add(node.source_path.parent.relative_to(root.source_path).as_posix())
 
-        if node.node_type == 'leaf':
+        # index.md 在 article 节点中处理
+        if node.node_type == 'leaf' and node.source_path.name != 'index.md':
             Path.mkdir(node.destination_path.parent, parents=True, exist_ok=True)
-            if node.source_path.name == 'index.md':
-                with open(node.destination_path, mode='w', encoding='utf-8') as f:
-                    f.write(gen_article_index(node.source_path, node.source_path.parent.name))
-            else:
-                # shutil.copy(node.source_path, node.destination_path)
+            if update_manifest(old_manifest, new_manifest, root, node.source_path, node.destination_path):
+                skipped += 1
+            elif node.source_path.suffix.lower() in COMPRESSIBLE_IMAGE_SUFFIXES:
                 # 图片压缩
-                process_pool.submit(compress_image, node.source_path, node.destination_path)
+                compress_futures.append(process_pool.submit(compress_image, node.source_path, node.destination_path))
                 logger.info(f'压缩图片: {node.source_path} -> {node.destination_path}')
-                # pass
+            else:
+                copy_file_fast(node.source_path, node.destination_path)
+
+    # markdown -> html 是 CPU 密集型任务，在进程池中并行渲染，结果在主进程写入
+    rendered = process_pool.map(
+        gen_article_index,
+        [node.source_path.name for node in article_jobs],
+        [node.metadata for node in article_jobs],
+        [node.md_body for node in article_jobs],
+        chunksize=4,
+    )
+
+    # 进程池的工作进程在提交任务时才 fork，所有任务提交后再启动线程，避免在多线程状态下 fork
+    resource_future = None
+    if resource_task is not None:
+        resource_executor = ThreadPoolExecutor(max_workers=1)
+        resource_future = resource_executor.submit(resource_task)
+        resource_executor.shutdown(wait=False)
+
+    for node, html in zip(article_jobs, rendered):
+        (node.destination_path / Path('index.html')).write_text(html, encoding='utf-8')
+
+    for node in category_nodes:
+        category_index = node.destination_path / Path('index.html')
+        categories: list[dict[str, Any]] = []
+        for child in node.children:
+            if child:
+                relative_path = child.destination_path.name / Path('index.html')
+                categories.append({
+                    'type': child.node_type,
+                    'name': child.destination_path.name,
+                    'href': relative_path,
+                    'metadata': child.metadata,
+                    'sort_key': child.sort_key,
+                })
+
+        key = node.source_path.relative_to(root.source_path).as_posix()
+        # 记录子节点名称和类型，子节点类型变化（比如文章删除 index.md 变为分类）时也要重新生成
+        children = sorted([c['name'], c['type']] for c in categories)
+        new_manifest[key] = {
+            'children': children,
+            'destination': category_index.relative_to(root.destination_path).as_posix(),
+        }
+        old_entry = old_manifest.get(key)
+        if (key not in dirty_categories and old_entry and old_entry.get('children') == children
+                and category_index.exists()):
+            skipped += 1
+            continue
+
+        categories.sort(key=lambda c: c['sort_key'])
+        with open(category_index, mode='w', encoding='utf-8') as f:
+            f.write(gen_category_index(categories, node.source_path.name))
+
+    if resource_future is not None:
+        # 复制静态资源失败时在这里抛出异常，中止构建
+        resource_future.result()
+
+    # 等待图片压缩完成再清理过期文件和保存 manifest：
+    # 清理空目录时目录中的新图片可能还没写入，压缩失败也需要在这里抛出异常
+    for future in compress_futures:
+        future.result()
+
+    remove_stale_outputs(root, old_manifest, new_manifest)
+    save_manifest(manifest_path, signature, new_manifest)
 
     end = int(time.time() * 1000)
-    logger.info(f'生成目标目录耗时: {end - start} ms')
+    logger.info(f'生成目标目录耗时: {end - start} ms, 跳过未变化节点: {skipped}')
 
 
-def gen_blog_archive(blog_dir_str: str, blog_target_dir_str: str, root: Node, target_name: str='public'):
+def gen_blog_archive(blog_dir_str: str, blog_target_dir_str: str, root: Node, tree_nodes: list[Node], target_name: str='public'):
     """
     生成博客 archive 页面
     按照年份分栏，日期排序，展示所有的博客文章
@@ -284,18 +543,11 @@ def gen_blog_archive(blog_dir_str: str, blog_target_dir_str: str, root: Node, ta
     root_node_path = root.destination_path
     blog_dir = Path(blog_dir_str)
 
-    q = deque()
-    q.append(root)
-    articles = []
-    while q:
-        node = q.popleft()
-        [q.append(child) for child in node.children]
-        if node.node_type == 'article':
-            articles.append(node)
+    articles = [node for node in tree_nodes if node.node_type == 'article']
 
-    archives = OrderedDict()
+    archives: OrderedDict[str, dict[str, Any]] = OrderedDict()
     # 先将所有文章按日期降序排列
-    articles_sorted = sorted(articles, key=lambda a: a.metadata['date'], reverse=True)
+    articles_sorted = sorted(articles, key=lambda a: (a.metadata or {}).get('date', ''), reverse=True)
 
     for article in articles_sorted:
         article_name = article.source_path.name
@@ -303,7 +555,7 @@ def gen_blog_archive(blog_dir_str: str, blog_target_dir_str: str, root: Node, ta
         base_path = Path(blog_target_dir_str) / Path(target_name)
         url = full_path.relative_to(base_path)
 
-        article_datetime = article.metadata.get('date')
+        article_datetime = (article.metadata or {}).get('date', '')
         article_year = article_datetime[:4]
         article_date = article_datetime[:10]
         if article_year not in archives:
@@ -320,12 +572,56 @@ def gen_blog_archive(blog_dir_str: str, blog_target_dir_str: str, root: Node, ta
         archives[article_year]['total'] += 1
 
 
-    template = Template(load_template('archive.html'))
-    html = template.render(archives=archives)
+    html = template_env.get_template('archive.html').render(archives=archives)
 
     root_node_path.joinpath('archive.html').write_text(data=html, encoding='utf-8')
 
 
+def copy_file_fast(src: Union[str, Path], dst: Union[str, Path]):
+    """
+    复制文件内容并保留访问/修改时间，不复制权限
+    优先使用 FICLONE（btrfs/XFS 等文件系统上只复制元数据），
+    不支持时退回 shutil.copyfile（Linux 上内部使用 sendfile / copy_file_range）
+    """
+    cloned = False
+    if HAS_FCNTL:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            cloned = True
+        except OSError:
+            pass
+    if not cloned:
+        shutil.copyfile(src, dst)
+
+    st = os.stat(src)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def copy_tree_threaded(src_dir: Union[str, Path], dst_dir: Union[str, Path], max_workers: int = 32):
+    """
+    多线程复制目录，复制文件是 IO 密集型任务，读写时会释放 GIL
+    只复制文件内容和修改时间（copy_file_fast），不复制权限
+    :param src_dir: 源目录
+    :param dst_dir: 目标目录，已存在的文件会被覆盖
+    :param max_workers: 线程数，机械硬盘建议调小
+    """
+    copy_pairs = []
+    dst_dirs = set()
+    for dir_path, _, file_names in os.walk(src_dir):
+        target_dir = os.path.join(dst_dir, os.path.relpath(dir_path, src_dir))
+        dst_dirs.add(target_dir)
+        for file_name in file_names:
+            copy_pairs.append((os.path.join(dir_path, file_name), os.path.join(target_dir, file_name)))
+
+    # 先统一创建目录，避免多个线程同时创建
+    for target_dir in dst_dirs:
+        os.makedirs(target_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda pair: copy_file_fast(*pair), copy_pairs))
+
+
 def cp_resource(blog_target_path_str: str):
     """将包内 static 资源复制到目标目录下的 public/"""
     public_dir = Path(blog_target_path_str) / "public"
@@ -333,37 +629,39 @@ def cp_resource(blog_target_path_str: str):
     # 1. 复制 css/
     css_src = str(resources.files("djhx_blogger.static").joinpath("css"))
     css_dst = public_dir / "css"
-    shutil.copytree(css_src, css_dst, dirs_exist_ok=True)
+    copy_tree_threaded(css_src, css_dst)
 
     # 2. 复制 images/
     images_src = str(resources.files("djhx_blogger.static").joinpath("images"))
     images_dst = public_dir / "images"
-    shutil.copytree(images_src, images_dst, dirs_exist_ok=True)
-
+    copy_tree_threaded(images_src, images_dst)
 
-def read_metadata(md_file_path):
-    import re
-    with open(md_file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
 
-    # 正则提取元数据
-    match = re.match(r'^---\n([\s\S]*?)\n---\n', content)
-    if match:
-        metadata = match.group(1)
-        return parse_metadata(metadata)
-    return {}
+def split_front_matter(content: str) -> tuple[str, str]:
+    """
+    拆分文章开头的 YAML 元信息和正文
+    :param content: index.md 的完整内容
+    :return: (元信息字符串, 正文)，没有元信息时元信息字符串为空
+    """
+    # 直接查找开头和结尾的 --- 分隔行，不使用正则
+    if not content.startswith('---\n'):
+        return '', content
+    end = content.find('\n---\n', 3)
+    if end < 0:
+        return '', content
+    return content[4:end], content[end + 5:]
 
 
-def parse_metadata(metadata):
+def parse_metadata(metadata: str) -> dict[str, str]:
     """
     将元数据解析为字典
     title, date, summary
     """
     meta_dict = {}
     for line in metadata.split('\n'):
-        if ':' in line:
-            key, value = map(str.strip, line.split(':', 1))
-            meta_dict[key] = value
+        i = line.find(':')
+        if i >= 0:
+            meta_dict[line[:i].strip()] = line[i + 1:].strip()
     return meta_dict
 
 
@@ -483,11 +781,12 @@ def generate_blog(blog_dir: str, blog_target: str):
     start = time.time()
 
     logger.info("开始生成博客文件结构...")
-    root_node = walk_dir(blog_dir, blog_target)
-    gen_blog_dir(root_node)
-    gen_blog_archive(blog_dir, blog_target, root_node)
-    cp_resource(blog_target)
+    root_node, tree_nodes = walk_dir(blog_dir, blog_target)
+    # 复制静态资源是 IO 密集型任务，和 CPU 密集的文章渲染重叠执行
+    gen_blog_dir(root_node, tree_nodes, functools.partial(cp_resource, blog_target))
+    gen_blog_archive(blog_dir, blog_target, root_node, tree_nodes)
     process_pool.shutdown(wait=True)
+    prune_md_cache()
     end = time.time()
     logger.info(f'生成静态博客 {blog_dir} -> {root_node.destination_path}, 任务完成, 总耗时: {int((end-start)*1000)} ms')
     print_directory_stats(root_node.destination_path)